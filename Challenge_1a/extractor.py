@@ -1,44 +1,140 @@
 import fitz  # PyMuPDF
+import numpy as np
+import functools
+import os
 import re
 import statistics
+from bisect import bisect_left, bisect_right
 from collections import Counter
 
-def _profile_document_styles(doc):
-    """Performs a single pass to analyze the document's font styles and create font size hierarchy."""
-    spans = []
+# PDFs smaller than this are opened from an in-memory copy instead of the file
+IN_MEMORY_MAX_BYTES = 50_000_000
+
+# Slack added to bisect windows so float rounding never drops a size that the
+# exact abs() comparison applied afterwards would keep
+_SIZE_WINDOW_SLACK = 1e-6
+
+# get_text("dict") flags: the defaults minus image blocks, which are never used
+_TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+# Multi-lingual heading patterns (appendix/chapter/section match lowercased text)
+_NUMBERED_RE = re.compile(r'^(?:\d+\.\d+\.\d+\.\d+|\d+\.\d+\.\d+|\d+\.\d+|\d+\.|[IVXLCDM]+\.|[A-Za-z]\.)\s+')
+_APPENDIX_RE = re.compile(r'^(appendix|annex|anhang|appendice|附录|부록|приложение|ملحق)\b')
+_CHAPTER_RE = re.compile(r'^(chapter|chapitre|kapitel|capitolo|capítulo|章|장|глава|فصل)\s+')
+_SECTION_RE = re.compile(r'^(section|section|abschnitt|sezione|sección|节|섹션|раздел|قسم)\s+')
+
+# Numbering depth prefixes used to assign levels to numbered headings
+_NUM_DEPTH4_RE = re.compile(r'^\d+\.\d+\.\d+\.\d+')
+_NUM_DEPTH3_RE = re.compile(r'^\d+\.\d+\.\d+')
+_NUM_DEPTH2_RE = re.compile(r'^\d+\.\d+')
+_NUM_DEPTH1_RE = re.compile(r'^\d+\.')
+_ROMAN_RE = re.compile(r'^[IVXLCDM]+\.')
+_ALPHA_RE = re.compile(r'^[A-Za-z]\.')
+
+# Non-heading filters
+_SENTENCE_END_RE = re.compile(r'[.,;:!?]\s*$')
+_DATE1_RE = re.compile(r'^\d{1,2}\s+(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)\s+\d{4}$')
+_DATE2_RE = re.compile(r'^\d{1,2}[/-]\d{1,2}[/-]\d{2,4}$')
+_DATE3_RE = re.compile(r'^(january|february|march|april|may|june|july|august|september|october|november|december)\s+\d{1,2},?\s+\d{4}$')
+_ALLCAPS_RE = re.compile(r'^[A-Z]{2,}\s*$')
+_SPECIAL_CHAR_RE = re.compile(r'[^\w\s]')
+
+# Common non-heading lines (exact match against the lowercased line)
+_SKIP_TEXTS = frozenset({
+    'page', 'seite', 'página', 'pagina', 'страница', '页', '페이지',
+    'copyright', 'confidential', 'draft', 'preliminary',
+    'table of contents', 'inhaltsverzeichnis', 'índice', 'sommaire',
+    'date', 'remarks', 'version', 'revision', 'author', 'title'
+})
+
+# Keywords that keep a short single-word line, and that disqualify a title line (substring match)
+_SINGLE_WORD_KEEP_RE = re.compile(r'summary|background|introduction|conclusion|appendix')
+_TITLE_SKIP_RE = re.compile(r'page|copyright|confidential|draft')
+
+# Font weight keywords
+_BOLD_RE = re.compile(r'bold|heavy|black|demi', re.I)
+_MEDIUM_RE = re.compile(r'medium|semi', re.I)
+_TITLE_BOLD_RE = re.compile(r'bold|heavy|black', re.I)
+
+# Text cleanup
+_CTRL_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x84\x86-\x9f]')
+_WS_RE = re.compile(r'\s+')
+_TOC_TAIL_RE = re.compile(r'\s*[\._]{2,}\s*(\d+|[ivx]+)\s*$')
+_EDGE_PUNCT_RE = re.compile(r'^[\s\._]+|[\s\._]+$')
+
+# Unnumbered lines that are never reported as headings
+_EXCLUDED_HEADINGS = frozenset({'table of contents', 'contents', 'index'})
+
+# Font names repeat across every span of a document, so each is matched once;
+# the cache is bounded because subset-prefixed names differ between PDFs
+@functools.lru_cache(maxsize=1024)
+def _font_weight(font):
+    """Returns (is_bold, is_medium) for a font name."""
+    return bool(_BOLD_RE.search(font)), bool(_MEDIUM_RE.search(font))
+
+def _collect_spans(doc):
+    """
+    Extracts the text of every page exactly once so the style profiling and
+    heading passes can share it instead of each calling get_text("dict").
+    Font statistics are accumulated while the spans are visited, so only the
+    per-line data needed by the heading pass is kept in memory.
+    Returns (pages, font_size_stats, all_fonts), where pages holds one
+    (page_num, page_width, page_height, blocks) tuple per page, blocks is a
+    list of (block_bbox, lines) and lines a list of (line_bbox, text, size, font)
+    with the size and font of the line's first span.
+    Spans are profiled in content-stream order, which decides ties between
+    equally common sizes and fonts; blocks are returned in reading order.
+    """
+    pages = []
     font_size_stats = {}
+    all_fonts = Counter()
     
-    # Collect spans from all pages for comprehensive analysis
     for page in doc:
-        blocks = page.get_text("dict").get("blocks", [])
-        for block in blocks:
+        page_rect = page.rect
+        blocks = []
+        for block in page.get_text("dict", flags=_TEXT_FLAGS).get("blocks", []):
+            lines = []
             for line in block.get("lines", []):
-                spans.extend(line.get("spans", []))
+                spans = line.get("spans")
+                if not spans:
+                    continue
+                
+                # Analyze font sizes and their characteristics
+                for span in spans:
+                    font = span['font']
+                    size = round(span['size'], 2)
+                    
+                    stats = font_size_stats.get(size)
+                    if stats is None:
+                        stats = font_size_stats[size] = {
+                            'count': 0,
+                            'bold_count': 0,
+                            'fonts': Counter(),
+                            'total_chars': 0
+                        }
+                    
+                    stats['count'] += 1
+                    stats['fonts'][font] += 1
+                    stats['total_chars'] += len(span['text'].strip())
+                    all_fonts[font] += 1
+                    
+                    # Check if font indicates bold/heavy styling
+                    if _font_weight(font)[0]:
+                        stats['bold_count'] += 1
+                
+                text = "".join(s['text'] for s in spans).strip()
+                lines.append((line['bbox'], text, spans[0]['size'], spans[0]['font']))
+            blocks.append((block['bbox'], lines))
+        # Same stable (bottom, left) ordering as get_text(sort=True)
+        blocks.sort(key=lambda b: (b[0][3], b[0][0]))
+        pages.append((page.number, page_rect.width, page_rect.height, blocks))
+    
+    return pages, font_size_stats, all_fonts
 
-    if not spans:
+def _profile_document_styles(font_size_stats, all_fonts):
+    """Builds the font size hierarchy from the statistics gathered by _collect_spans."""
+    if not font_size_stats:
         return None
-
-    # Analyze font sizes and their characteristics
-    for span in spans:
-        size = round(span['size'], 2)
-        font = span['font']
-        text = span.get('text', '').strip()
-        
-        if size not in font_size_stats:
-            font_size_stats[size] = {
-                'count': 0,
-                'bold_count': 0,
-                'fonts': Counter(),
-                'total_chars': 0
-            }
-        
-        font_size_stats[size]['count'] += 1
-        font_size_stats[size]['fonts'][font] += 1
-        font_size_stats[size]['total_chars'] += len(text)
-        
-        # Check if font indicates bold/heavy styling
-        if any(keyword in font.lower() for keyword in ['bold', 'heavy', 'black', 'demi']):
-            font_size_stats[size]['bold_count'] += 1
     
     # Determine body text size (most frequent size with substantial content)
     body_candidates = [(size, stats) for size, stats in font_size_stats.items() 
@@ -51,9 +147,6 @@ def _profile_document_styles(doc):
         body_size = max(font_size_stats.items(), key=lambda x: x[1]['count'])[0] if font_size_stats else 10.0
     
     # Get most common font
-    all_fonts = Counter()
-    for stats in font_size_stats.values():
-        all_fonts.update(stats['fonts'])
     body_font = all_fonts.most_common(1)[0][0] if all_fonts else "Unknown"
     
     # Create sorted list of unique font sizes (largest first)
@@ -80,11 +173,18 @@ def _extract_title(doc, style_profile):
             return doc.metadata.get('title', 'Untitled')
 
         page = doc[0]  # Only process the first page (page 0) for the title
-        blocks = page.get_text("dict").get("blocks", [])
+        
+        blocks = page.get_text("dict", flags=_TEXT_FLAGS).get("blocks", [])
         
         # Get all text lines from the top portion of the page
-        text_lines = []
-        top_section = page.rect.height * 0.5  # Look at top half of page
+        page_height = page.rect.height
+        top_section = page_height * 0.5  # Look at top half of page
+        body_size = style_profile['body_size']
+        
+        # Track the topmost line of the largest font size as a fallback and
+        # score title candidates in the same pass over the lines
+        topmost_largest_line = None
+        title_candidates = []
         
         for block in blocks:
             if block['bbox'][1] > top_section:
@@ -100,95 +200,78 @@ def _extract_title(doc, style_profile):
                     continue
                     
                 # Clean text
-                text = re.sub(r'\s+', ' ', text)
-                text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x84\x86-\x9f]', '', text)
+                text = _WS_RE.sub(' ', text)
+                text = _CTRL_RE.sub('', text)
                 
                 span = line["spans"][0]
+                size = span['size']
+                y = line['bbox'][1]
+                
+                # Find the largest font size in the top section
+                if (topmost_largest_line is None or
+                    size > topmost_largest_line['size'] or
+                    (size == topmost_largest_line['size'] and y < topmost_largest_line['y'])):
+                    topmost_largest_line = {'text': text, 'y': y, 'size': size}
                 
-                text_lines.append({
+                # Look for title candidates - must be significantly larger than body text
+                if size < body_size * 1.3:
+                    continue
+                    
+                # Skip common non-title patterns
+                if _TITLE_SKIP_RE.search(text.lower()):
+                    continue
+                    
+                # Skip very long lines (likely paragraphs)
+                word_count = len(text.split())
+                if word_count > 20:
+                    continue
+                    
+                # Skip lines that end with periods (likely sentences)
+                if text.rstrip().endswith('.'):
+                    continue
+                    
+                # Calculate score based on size and position
+                score = 0
+                
+                # Size scoring - prefer largest fonts
+                size_ratio = size / body_size
+                if size_ratio >= 2.0:
+                    score += 10
+                elif size_ratio >= 1.5:
+                    score += 7
+                elif size_ratio >= 1.3:
+                    score += 5
+                
+                # Position scoring - prefer top of page
+                relative_y = y / page_height
+                if relative_y < 0.1:
+                    score += 5
+                elif relative_y < 0.2:
+                    score += 3
+                elif relative_y < 0.3:
+                    score += 1
+                
+                # Font weight scoring
+                if _TITLE_BOLD_RE.search(span['font']):
+                    score += 3
+                
+                # Reasonable length scoring
+                if 3 <= word_count <= 15:
+                    score += 2
+                
+                title_candidates.append({
                     'text': text,
-                    'y': line['bbox'][1],
-                    'size': span['size'],
-                    'font': span['font'],
-                    'bbox': line['bbox']
+                    'score': score,
+                    'y': y,
+                    'size': size
                 })
         
-        if not text_lines:
+        if topmost_largest_line is None:
             return doc.metadata.get('title', 'Untitled')
         
-        # Sort by y-position (top to bottom)
-        text_lines.sort(key=lambda x: x['y'])
-        
-        # Find the largest font size in the top section
-        max_size = max(line['size'] for line in text_lines)
-        body_size = style_profile['body_size']
-        
-        # Look for title candidates - must be significantly larger than body text
-        title_candidates = []
-        for line in text_lines:
-            # Skip if not significantly larger than body text
-            if line['size'] < body_size * 1.3:
-                continue
-                
-            # Skip common non-title patterns
-            text_lower = line['text'].lower()
-            if any(skip in text_lower for skip in ['page', 'copyright', 'confidential', 'draft']):
-                continue
-                
-            # Skip very long lines (likely paragraphs)
-            word_count = len(line['text'].split())
-            if word_count > 20:
-                continue
-                
-            # Skip lines that end with periods (likely sentences)
-            if line['text'].rstrip().endswith('.'):
-                continue
-                
-            # Calculate score based on size and position
-            score = 0
-            
-            # Size scoring - prefer largest fonts
-            size_ratio = line['size'] / body_size
-            if size_ratio >= 2.0:
-                score += 10
-            elif size_ratio >= 1.5:
-                score += 7
-            elif size_ratio >= 1.3:
-                score += 5
-            
-            # Position scoring - prefer top of page
-            relative_y = line['y'] / page.rect.height
-            if relative_y < 0.1:
-                score += 5
-            elif relative_y < 0.2:
-                score += 3
-            elif relative_y < 0.3:
-                score += 1
-            
-            # Font weight scoring
-            font_lower = line['font'].lower()
-            if any(weight in font_lower for weight in ['bold', 'heavy', 'black']):
-                score += 3
-            
-            # Reasonable length scoring
-            if 3 <= word_count <= 15:
-                score += 2
-            
-            title_candidates.append({
-                'text': line['text'],
-                'score': score,
-                'y': line['y'],
-                'size': line['size']
-            })
-        
         if not title_candidates:
-            
-            largest_lines = [line for line in text_lines if line['size'] == max_size]
-            if largest_lines:
-                # Take the topmost largest text
-                best_line = min(largest_lines, key=lambda x: x['y'])
-                return best_line['text']
-            return doc.metadata.get('title', 'Untitled')
+            # Take the topmost largest text
+            return topmost_largest_line['text']
         
         # Sort by score, then by position
         title_candidates.sort(key=lambda x: (-x['score'], x['y']))
@@ -213,7 +296,7 @@ def _extract_title(doc, style_profile):
                 break
         final_title = ' '.join(title_parts).strip()
         final_title = _clean_repetitive_title(final_title)
-        final_title = re.sub(r'\s+', ' ', final_title)
+        final_title = _WS_RE.sub(' ', final_title)
         
         return final_title if final_title else doc.metadata.get('title', 'Untitled')
 
@@ -228,30 +311,153 @@ def _is_repetitive_text(text):
     word_counts = {}
     for word in words:
         if len(word) > 2: 
-            word_counts[word] = word_counts.get(word, 0) + 1
-    for count in word_counts.values():
-        if count > 3:
-            return True
+            count = word_counts[word] = word_counts.get(word, 0) + 1
+            if count > 3:
+                return True
             
     return False
 
 def _clean_repetitive_title(title):
+    """
+    Drops a word that repeats the previous word, or that repeats the word two
+    back when the word in between was kept. Each word is lowercased once.
+    """
     words = title.split()
+    lowered = [word.lower() for word in words]
     cleaned_words = []
+    last_kept = None  # lowercased cleaned_words[-1]
     
     for i, word in enumerate(words):
-        if i > 0 and word.lower() == words[i-1].lower():
+        low = lowered[i]
+        if i > 0 and low == lowered[i-1]:
             continue
-        if (i > 1 and 
-            word.lower() == words[i-2].lower() and 
-            len(cleaned_words) > 1 and 
-            cleaned_words[-1].lower() == words[i-1].lower()):
+        if (i > 1 and
+            low == lowered[i-2] and
+            len(cleaned_words) > 1 and
+            last_kept == lowered[i-1]):
             continue
         cleaned_words.append(word)
+        last_kept = low
     
     return ' '.join(cleaned_words)
 
-def _extract_headings(doc, style_profile, title):
+@functools.lru_cache(maxsize=8192)
+def _score_line(text, font):
+    """
+    Scores the text- and font-derived heading features of a line.
+    Running headers, footers and repeated labels recur across pages, so the
+    result is memoized; size, position and spacing are scored by the caller.
+    Returns None when the text is filtered out as a non-heading, otherwise
+    (score, word_count, is_bold, is_numbered, is_appendix, is_chapter,
+    is_section, is_all_caps).
+    """
+    text_len = len(text)
+    if text_len < 2:
+        return None
+    
+    # Enhanced filtering for non-headings
+    word_count = len(text.split())
+    
+    # Skip very long text (likely paragraphs, not headings)
+    if word_count > 15:  
+        return None
+    
+    # Skip text ending with sentence punctuation (likely body text)
+    if _SENTENCE_END_RE.search(text):
+        return None
+    
+    # Skip very short text (likely not meaningful headings)
+    if word_count < 2:
+        return None
+    
+    # Skip common non-heading patterns
+    text_lower = text.lower()
+    if text_lower in _SKIP_TEXTS:  # Exact match
+        return None
+    
+    # Skip date-like patterns (various formats)
+    if (_DATE1_RE.match(text_lower) or
+        _DATE2_RE.match(text) or
+        _DATE3_RE.match(text_lower)):
+        return None
+    
+    # Skip table-like content and single word labels
+    if (word_count == 1 and text_len < 12 and 
+        not _NUM_DEPTH1_RE.match(text) and 
+        not _SINGLE_WORD_KEEP_RE.search(text_lower)):
+        return None
+    
+    # Skip lines that look like table headers or data
+    if _ALLCAPS_RE.match(text):  # All caps single words/abbreviations
+        return None
+    
+    # Skip lines with excessive punctuation or special characters
+    if len(_SPECIAL_CHAR_RE.findall(text)) > text_len * 0.3:
+        return None
+    
+    # Enhanced heading detection with multilingual support
+    # Font style analysis
+    is_bold, is_medium = _font_weight(font)
+    
+    # Pattern matching (multilingual)
+    is_numbered = bool(_NUMBERED_RE.match(text))
+    is_appendix = bool(_APPENDIX_RE.match(text_lower))
+    is_chapter = bool(_CHAPTER_RE.match(text_lower))
+    is_section = bool(_SECTION_RE.match(text_lower))
+    
+    # Text formatting analysis
+    is_all_caps = text.isupper() and word_count <= 10  # Reasonable caps limit
+    is_title_case = text.istitle()
+    is_short = word_count <= 15
+    
+    # Enhanced scoring system with stricter criteria
+    score = 0
+    
+    # Font style scoring
+    if is_bold: score += 4
+    elif is_medium: score += 2
+    
+    # Pattern-based scoring (high weight for clear patterns)
+    if is_numbered: score += 6
+    if is_chapter: score += 5
+    if is_section: score += 4
+    if is_appendix: score += 5
+    
+    # Formatting scoring
+    if is_all_caps and word_count <= 5: score += 3  # Only short all-caps
+    elif is_title_case: score += 2
+    
+    # Context scoring
+    if is_short and word_count >= 2: score += 2  # Reasonable length
+    
+    return (score, word_count, is_bold, is_numbered, is_appendix,
+            is_chapter, is_section, is_all_caps)
+
+def _score_headings(base_scores, size_scores, size_ratios, word_counts,
+                    is_bold, is_structured, is_positioned, has_space_before):
+    """
+    Combines the per-line feature arrays into heading scores and the dynamic
+    threshold each line must reach. Returns (scores, thresholds).
+    """
+    is_larger = size_ratios > 1.1
+    is_much_larger = size_ratios > 1.5
+    
+    scores = (
+        base_scores + size_scores +
+        # Position scoring (less weight)
+        is_positioned +
+        # Context scoring
+        3 * has_space_before
+    )
+    
+    # Dynamic threshold based on content characteristics: higher for
+    # potentially problematic content, lower for clearly structured headings
+    thresholds = np.where((word_counts > 10) | ~is_larger, 10,
+                 np.where(is_structured, 6,
+                 np.where((is_much_larger & is_bold) | ((word_counts <= 5) & is_larger), 7, 8)))
+    return scores, thresholds
+
+def _extract_headings(pages, style_profile, title):
     """
     Extracts headings from page 1 to the end of the PDF.
     Uses enhanced font size dictionary analysis and formatting checks
@@ -259,217 +465,139 @@ def _extract_headings(doc, style_profile, title):
     """
     heading_candidates = []
     body_size = style_profile['body_size']
+    min_space_before = body_size * 1.2
+    largest_size = style_profile['heading_sizes']['largest']
+    second_largest_size = style_profile['heading_sizes']['second_largest']
+    third_largest_size = style_profile['heading_sizes']['third_largest']
+    
+    # Size-based score per distinct span size, filled lazily: a document only
+    # uses a handful of sizes, so each ratio/tier is evaluated once
+    size_scores = {}
+    
+    # Per-line features of lines that pass the text filters, in document order
+    lines_info = []
+    size_rows = []
+    context_rows = []
     
     # Enhanced dictionary to store font sizes and their characteristics
     font_size_profiles = {}
     
-    # Multi-lingual heading patterns
-    heading_patterns = {
-        'numbered': r'^(?:\d+\.\d+\.\d+\.\d+|\d+\.\d+\.\d+|\d+\.\d+|\d+\.|[IVXLCDM]+\.|[A-Za-z]\.)\s+',
-        'appendix': r'^(appendix|annex|anhang|appendice|附录|부록|приложение|ملحق)\b',
-        'chapter': r'^(chapter|chapitre|kapitel|capitolo|capítulo|章|장|глава|فصل)\s+',
-        'section': r'^(section|section|abschnitt|sezione|sección|节|섹션|раздел|قسم)\s+'
-    }
-    
     # Start heading extraction from page 1 (index 1) - skip page 0 which is for title
-    for page_num in range(1, len(doc)):
-        page = doc.load_page(page_num)
-        blocks = page.get_text("dict", sort=True).get("blocks", [])
-        previous_block = None
-        
-        for block in blocks:
+    for page_num, page_width, page_height, blocks in pages[1:]:
+        previous_block_bbox = None
+        top_margin = page_height * 0.08
+        bottom_margin = page_height * 0.92
+        page_center = page_width / 2
+        left_margin = page_width * 0.2
+
+        for block_bbox, lines in blocks:
             # Skip headers/footers with more precise detection
-            page_height = page.rect.height
-            if (block['bbox'][1] < page_height * 0.08 or 
-                block['bbox'][3] > page_height * 0.92):
+            if (block_bbox[1] < top_margin or
+                block_bbox[3] > bottom_margin):
                 continue
+
+            for line_bbox, text, span_size, span_font in lines:
                 
-            for line in block.get("lines", []):
-                if not line['spans']:
-                    continue
-                    
-                span = line['spans'][0]
-                text = "".join(s['text'] for s in line['spans']).strip()
-                
-                if not text or len(text) < 2:
-                    continue
-                
-                # Enhanced filtering for non-headings
-                word_count = len(text.split())
-                
-                # Skip very long text (likely paragraphs, not headings)
-                if word_count > 15:  
-                    continue
-                
-                # Skip text ending with sentence punctuation (likely body text)
-                if re.search(r'[.,;:!?]\s*$', text):
-                    continue
-                
-                # Skip very short text (likely not meaningful headings)
-                if word_count < 2:
-                    continue
-                
-                # Skip common non-heading patterns
-                text_lower = text.lower().strip()
-                skip_patterns = {
-                    'page', 'seite', 'página', 'pagina', 'страница', '页', '페이지',
-                    'copyright', 'confidential', 'draft', 'preliminary',
-                    'table of contents', 'inhaltsverzeichnis', 'índice', 'sommaire',
-                    'date', 'remarks', 'version', 'revision', 'author', 'title'
-                }
-                if any(pattern == text_lower for pattern in skip_patterns):  # Exact match
-                    continue
-                
-                # Skip date-like patterns (various formats)
-                if (re.match(r'^\d{1,2}\s+(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)\s+\d{4}$', text_lower) or
-                    re.match(r'^\d{1,2}[/-]\d{1,2}[/-]\d{2,4}$', text) or
-                    re.match(r'^(january|february|march|april|may|june|july|august|september|october|november|december)\s+\d{1,2},?\s+\d{4}$', text_lower)):
-                    continue
-                
-                # Skip table-like content and single word labels
-                if (word_count == 1 and len(text) < 12 and 
-                    not re.match(r'^\d+\.', text) and 
-                    not any(keyword in text_lower for keyword in ['summary', 'background', 'introduction', 'conclusion', 'appendix'])):
-                    continue
-                
-                # Skip lines that look like table headers or data
-                if re.match(r'^[A-Z]{2,}\s*$', text):  # All caps single words/abbreviations
-                    continue
-                
-                # Skip lines with excessive punctuation or special characters
-                if len(re.findall(r'[^\w\s]', text)) > len(text) * 0.3:
+                features = _score_line(text, span_font)
+                if features is None:
                     continue
                 
-                # Enhanced heading detection with multilingual support
-                font_lower = span['font'].lower()
-                
-                # Font style analysis
-                is_bold = any(keyword in font_lower for keyword in ['bold', 'heavy', 'black', 'demi'])
-                is_medium = any(keyword in font_lower for keyword in ['medium', 'semi'])
-                
                 # Size analysis using the enhanced profile
-                size_ratio = span['size'] / body_size
-                is_larger = size_ratio > 1.1
-                is_much_larger = size_ratio > 1.5
-                
-                # Pattern matching (multilingual)
-                is_numbered = bool(re.match(heading_patterns['numbered'], text))
-                is_appendix = bool(re.match(heading_patterns['appendix'], text.lower()))
-                is_chapter = bool(re.match(heading_patterns['chapter'], text.lower()))
-                is_section = bool(re.match(heading_patterns['section'], text.lower()))
-                
-                # Text formatting analysis
-                is_all_caps = text.isupper() and word_count <= 10  # Reasonable caps limit
-                is_title_case = text.istitle()
-                is_short = word_count <= 15
+                size_entry = size_scores.get(span_size)
+                if size_entry is None:
+                    ratio = span_size / body_size
+                    size_entry = size_scores[span_size] = (
+                        ratio,
+                        # Size-based scoring (more weight)
+                        (6 if ratio > 1.5 else 4 if ratio > 1.1 else 2 if ratio > 1.05 else 0) +
+                        # Top font size bonus
+                        (4 if abs(span_size - largest_size) < 1 else
+                         3 if abs(span_size - second_largest_size) < 1 else
+                         2 if abs(span_size - third_largest_size) < 1 else 0)
+                    )
                 
                 # Position analysis
-                line_center = (line['bbox'][0] + line['bbox'][2]) / 2
-                page_center = page.rect.width / 2
+                line_center = (line_bbox[0] + line_bbox[2]) / 2
                 is_centered = abs(line_center - page_center) < 50
-                is_left_aligned = line['bbox'][0] < page.rect.width * 0.2
+                is_left_aligned = line_bbox[0] < left_margin
                 
                 # Spacing analysis
-                has_space_before = (
-                    previous_block and 
-                    (block['bbox'][1] - previous_block['bbox'][3]) > body_size * 1.2
+                has_space_before = bool(
+                    previous_block_bbox and 
+                    (block_bbox[1] - previous_block_bbox[3]) > min_space_before
                 )
                 
-                # Check if it matches one of the top font sizes from the profile
-                is_top_size = abs(span['size'] - style_profile['heading_sizes']['largest']) < 1
-                is_second_size = abs(span['size'] - style_profile['heading_sizes']['second_largest']) < 1
-                is_third_size = abs(span['size'] - style_profile['heading_sizes']['third_largest']) < 1
-                
-                # Enhanced scoring system with stricter criteria
-                score = 0
-                
-                # Size-based scoring (more weight)
-                if is_much_larger: score += 6
-                elif is_larger: score += 4
-                elif size_ratio > 1.05: score += 2
-                
-                # Font style scoring
-                if is_bold: score += 4
-                elif is_medium: score += 2
-                
-                # Pattern-based scoring (high weight for clear patterns)
-                if is_numbered: score += 6
-                if is_chapter: score += 5
-                if is_section: score += 4
-                if is_appendix: score += 5
-                
-                # Formatting scoring
-                if is_all_caps and word_count <= 5: score += 3  # Only short all-caps
-                elif is_title_case: score += 2
-                
-                # Position scoring (less weight)
-                if is_centered: score += 1
-                elif is_left_aligned: score += 1
-                
-                # Context scoring
-                if has_space_before: score += 3
-                if is_short and word_count >= 2: score += 2  # Reasonable length
-                
-                # Top font size bonus
-                if is_top_size: score += 4
-                elif is_second_size: score += 3
-                elif is_third_size: score += 2
-                
-                # Dynamic threshold based on content characteristics
-                min_threshold = 8  # Base threshold
-                
-                # Lower threshold for clearly structured headings
-                if is_numbered or is_chapter or is_appendix:
-                    min_threshold = 6
-                elif is_much_larger and is_bold:
-                    min_threshold = 7
-                elif word_count <= 5 and is_larger:
-                    min_threshold = 7
-                
-                # Higher threshold for potentially problematic content
-                if word_count > 10 or not is_larger:
-                    min_threshold = 10
-                
-                if score >= min_threshold:
-                    heading_candidates.append({
-                        "text": text,
-                        "size": span['size'],
-                        "font": span['font'],
-                        "page": page_num, 
-                        "y": line['bbox'][1],
-                        "score": score,
-                        "is_numbered": is_numbered,
-                        "is_appendix": is_appendix,
-                        "is_chapter": is_chapter,
-                        "is_section": is_section,
-                        "is_bold": is_bold,
-                        "is_all_caps": is_all_caps,
-                        "size_ratio": size_ratio
-                    })
-                    
-                    # Update enhanced font size profiles
-                    rounded_size = round(span['size'], 2)
-                    if rounded_size not in font_size_profiles:
-                        font_size_profiles[rounded_size] = {
-                            'count': 0, 
-                            'bold_count': 0, 
-                            'caps_count': 0, 
-                            'total_score': 0,
-                            'avg_score': 0,
-                            'numbered_count': 0,
-                            'fonts': Counter()
-                        }
+                lines_info.append((text, span_size, span_font, page_num, line_bbox[1], features))
+                size_rows.append(size_entry)
+                context_rows.append((is_centered or is_left_aligned, has_space_before))
                     
-                    profile = font_size_profiles[rounded_size]
-                    profile['count'] += 1
-                    profile['fonts'][span['font']] += 1
-                    if is_bold: profile['bold_count'] += 1
-                    if is_all_caps: profile['caps_count'] += 1
-                    if is_numbered: profile['numbered_count'] += 1
-                    profile['total_score'] += score
-                    profile['avg_score'] = profile['total_score'] / profile['count']
-                    
-            previous_block = block
+            previous_block_bbox = block_bbox
+    
+    if not lines_info:
+        return []
+    
+    # Score every surviving line at once: the per-line features above are
+    # gathered into typed arrays and handed to the array kernel
+    (base_scores, word_counts, is_bold, is_numbered, is_appendix,
+     is_chapter, _, _) = zip(*(info[5] for info in lines_info))
+    size_ratios, line_size_scores = zip(*size_rows)
+    is_positioned, has_space_before = zip(*context_rows)
+    is_structured = [numbered or chapter or appendix
+                     for numbered, chapter, appendix in zip(is_numbered, is_chapter, is_appendix)]
+    
+    scores, min_thresholds = _score_headings(
+        np.array(base_scores, dtype=np.int64),
+        np.array(line_size_scores, dtype=np.int64),
+        np.array(size_ratios, dtype=np.float64),
+        np.array(word_counts, dtype=np.int64),
+        np.array(is_bold, dtype=np.bool_),
+        np.array(is_structured, dtype=np.bool_),
+        np.array(is_positioned, dtype=np.int64),
+        np.array(has_space_before, dtype=np.int64)
+    )
+    
+    for i in np.flatnonzero(scores >= min_thresholds):
+        text, span_size, span_font, page_num, y, features = lines_info[i]
+        (_, _, is_bold, is_numbered, is_appendix,
+         is_chapter, is_section, is_all_caps) = features
+        score = int(scores[i])
+        heading_candidates.append({
+            "text": text,
+            "size": span_size,
+            "font": span_font,
+            "page": page_num, 
+            "y": y,
+            "score": score,
+            "is_numbered": is_numbered,
+            "is_appendix": is_appendix,
+            "is_chapter": is_chapter,
+            "is_section": is_section,
+            "is_bold": is_bold,
+            "is_all_caps": is_all_caps,
+            "size_ratio": size_rows[i][0]
+        })
+        
+        # Update enhanced font size profiles
+        rounded_size = round(span_size, 2)
+        if rounded_size not in font_size_profiles:
+            font_size_profiles[rounded_size] = {
+                'count': 0, 
+                'bold_count': 0, 
+                'caps_count': 0, 
+                'total_score': 0,
+                'avg_score': 0,
+                'numbered_count': 0,
+                'fonts': Counter()
+            }
+        
+        profile = font_size_profiles[rounded_size]
+        profile['count'] += 1
+        profile['fonts'][span_font] += 1
+        if is_bold: profile['bold_count'] += 1
+        if is_all_caps: profile['caps_count'] += 1
+        if is_numbered: profile['numbered_count'] += 1
+        profile['total_score'] += score
+        profile['avg_score'] = profile['total_score'] / profile['count']
     
     if not heading_candidates:
         return []
@@ -495,17 +623,17 @@ def _extract_headings(doc, style_profile, title):
         text = h['text']
         level = "H1"  # Default
         
-        if re.match(r'^\d+\.\d+\.\d+\.\d+', text):
+        if _NUM_DEPTH4_RE.match(text):
             level = "H4"
-        elif re.match(r'^\d+\.\d+\.\d+', text):
+        elif _NUM_DEPTH3_RE.match(text):
             level = "H3"
-        elif re.match(r'^\d+\.\d+', text):
+        elif _NUM_DEPTH2_RE.match(text):
             level = "H2"
-        elif re.match(r'^\d+\.', text):
+        elif _NUM_DEPTH1_RE.match(text):
             level = "H1"
-        elif re.match(r'^[IVXLCDM]+\.', text):  # Roman numerals
+        elif _ROMAN_RE.match(text):  # Roman numerals
             level = "H1"
-        elif re.match(r'^[A-Za-z]\.', text):  # Alphabetical
+        elif _ALPHA_RE.match(text):  # Alphabetical
             level = "H2"  # Often sub-level
         
         outline.append({
@@ -528,10 +656,18 @@ def _extract_headings(doc, style_profile, title):
         unique_sizes = list(set(round(h['size'], 2) for h in unnumbered_headings))
         unique_sizes.sort(reverse=True)  # Largest first
         
+        # Ascending views so each size's neighbourhood is found with bisect
+        # instead of scanning every heading/size
+        ascending_sizes = unique_sizes[::-1]
+        headings_by_size = sorted(unnumbered_headings, key=lambda h: h['size'])
+        heading_size_keys = [h['size'] for h in headings_by_size]
+        
         # Enhanced size tier analysis with better hierarchy detection
         size_analysis = {}
         for size in unique_sizes:
-            headings_with_size = [h for h in unnumbered_headings if abs(h['size'] - size) < 0.5]
+            lo = bisect_left(heading_size_keys, size - 0.5 - _SIZE_WINDOW_SLACK)
+            hi = bisect_right(heading_size_keys, size + 0.5 + _SIZE_WINDOW_SLACK)
+            headings_with_size = [h for h in headings_by_size[lo:hi] if abs(h['size'] - size) < 0.5]
             
             size_analysis[size] = {
                 'count': len(headings_with_size),
@@ -585,39 +721,47 @@ def _extract_headings(doc, style_profile, title):
                         break
             
             if assigned_level:
-                # Group similar sizes together
-                for check_size in unique_sizes:
+                # Group similar sizes together (largest first, as before)
+                lo = bisect_left(ascending_sizes, size - 1.0 - _SIZE_WINDOW_SLACK)
+                hi = bisect_right(ascending_sizes, size + 1.0 + _SIZE_WINDOW_SLACK)
+                for check_size in reversed(ascending_sizes[lo:hi]):
                     if abs(check_size - size) < 1.0:  # Similar sizes
                         size_level_map[check_size] = assigned_level
+            
+            # Every level is taken, so no later size can be assigned one
+            if len(assigned_levels) == len(level_thresholds):
+                break
+        
+        # Sorted mapped sizes for nearest-size lookup; equal distances resolve
+        # to the size that was mapped first
+        mapped_sizes = sorted(size_level_map)
+        mapped_rank = {size: rank for rank, size in enumerate(size_level_map)}
         
         # Apply level mapping to unnumbered headings
+        title_lower = title.lower()
         unnumbered_headings.sort(key=lambda x: (x['page'], x['y']))
         for h in unnumbered_headings:
             size_key = round(h['size'], 2)
             
             # Find the closest mapped size
-            closest_size = min(size_level_map.keys(), 
-                             key=lambda s: abs(s - size_key), 
+            i = bisect_left(mapped_sizes, size_key)
+            closest_size = min(mapped_sizes[max(i - 1, 0):i + 1],
+                             key=lambda s: (abs(s - size_key), mapped_rank[s]),
                              default=None)
             
             if closest_size and abs(closest_size - size_key) < 2.0:
                 level = size_level_map[closest_size]
                 
-                # Enhanced text cleaning
-                clean_text = h['text'].strip()
-                # Remove trailing dots, numbers, underscores from TOC-style entries
-                clean_text = re.sub(r'\s*[\._]{2,}\s*(\d+|[ivx]+)\s*$', '', clean_text)
-                # Remove excessive whitespace and control characters
-                clean_text = re.sub(r'\s+', ' ', clean_text)
-                clean_text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x84\x86-\x9f]', '', clean_text)
-                # Remove leading/trailing punctuation and whitespace
-                clean_text = re.sub(r'^[\s\._]+|[\s\._]+$', '', clean_text)
+                # Enhanced text cleaning (candidate text is already stripped):
+                # drop TOC-style dot/number tails, collapse whitespace, remove
+                # control characters, then trim edge punctuation and whitespace
+                clean_text = _EDGE_PUNCT_RE.sub('', _CTRL_RE.sub('', _WS_RE.sub(' ', _TOC_TAIL_RE.sub('', h['text']))))
                 
                 # Additional filtering
-                if (clean_text and 
-                    len(clean_text) > 2 and
-                    clean_text.lower() != title.lower() and
-                    not clean_text.lower() in {'table of contents', 'contents', 'index'}):
+                if len(clean_text) <= 2:
+                    continue
+                clean_lower = clean_text.lower()
+                if clean_lower != title_lower and clean_lower not in _EXCLUDED_HEADINGS:
                     
                     outline.append({
                         "level": level,
@@ -638,27 +782,53 @@ def _extract_headings(doc, style_profile, title):
             filtered_outline.append(item)
     return filtered_outline
 
-def extract_document_structure(pdf_path):
-    """Main function to extract document structure."""
-    try:
-        doc = fitz.open(pdf_path)
-    except Exception as e:
-        return {"title": f"Error: Failed to open or read PDF: {e}", "outline": []}
+def _error_result(message):
+    """Builds the result returned when a PDF cannot be processed."""
+    return {"status": "error", "title": "", "outline": [], "error": message}
 
+def _extract_from_doc(doc):
+    """Extracts the title and outline from an opened document, closing it when done."""
     if len(doc) == 0:
-        return {"title": "Error: Empty or invalid PDF.", "outline": []}
+        return _error_result("Empty or invalid PDF.")
 
-    style_profile = _profile_document_styles(doc)
+    pages, font_size_stats, all_fonts = _collect_spans(doc)
+    style_profile = _profile_document_styles(font_size_stats, all_fonts)
     if not style_profile:
         doc.close()
-        return {"title": "Error: PDF contains no text content.", "outline": []}
+        return _error_result("PDF contains no text content.")
 
     try:
         title = _extract_title(doc, style_profile)
-        outline = _extract_headings(doc, style_profile, title)
+        outline = _extract_headings(pages, style_profile, title)
     except Exception as e:
-        return {"title": f"Error: Failed during content extraction: {e}", "outline": []}
+        return _error_result(f"Failed during content extraction: {e}")
     finally:
         doc.close()
 
-    return {"title": title, "outline": outline}
+    return {"status": "ok", "title": title, "outline": outline}
+
+def extract_document_structure(pdf_path):
+    """
+    Main function to extract document structure. Returns a dict with "status"
+    ("ok" or "error"), "title" and "outline", plus an "error" message on failure.
+    """
+    try:
+        # Small PDFs are read in one go and parsed from memory
+        if os.path.getsize(pdf_path) < IN_MEMORY_MAX_BYTES:
+            with open(pdf_path, 'rb') as f:
+                doc = fitz.open(stream=f.read(), filetype='pdf')
+        else:
+            doc = fitz.open(pdf_path)
+    except Exception as e:
+        return _error_result(f"Failed to open or read PDF: {e}")
+
+    return _extract_from_doc(doc)
+
+def extract_document_structure_from_bytes(data):
+    """Extracts document structure from PDF content already read into memory."""
+    try:
+        doc = fitz.open(stream=data, filetype='pdf')
+    except Exception as e:
+        return _error_result(f"Failed to open or read PDF: {e}")
+
+    return _extract_from_doc(doc)
@@ -1,37 +1,452 @@
+import asyncio
+import gc
+import hashlib
 import json
+import logging
+import mmap
+import os
+import sys
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from extractor import extract_document_structure
+import extractor
+from extractor import IN_MEMORY_MAX_BYTES, extract_document_structure, extract_document_structure_from_bytes
 
-def process_pdfs():
-    print("Starting processing PDFs")
+try:
+    import orjson
+except ImportError:  # fall back to the standard library encoder
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # compressed output is optional
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional
+    pa = pq = None
+
+logger = logging.getLogger("pdfproc")
+
+CACHE_DIR_NAME = ".cache"
+CACHE_INDEX_NAME = "index.json"
+PREFETCH_DEPTH = 4
+# Opt-in: write zstd-compressed <stem>.json.zst files instead of plain JSON
+COMPRESS_OUTPUT = os.environ.get("COMPRESS_OUTPUT") == "1" and zstandard is not None
+# Opt-in: split outputs across up to 256 <output>/<xx>/ subdirectories of about N/256 files each
+SHARD_OUTPUT = os.environ.get("SHARD_OUTPUT") == "1"
+# Opt-in: collect every outline into a single Parquet file instead of per-PDF JSON
+PARQUET_OUTPUT = os.environ.get("PARQUET_OUTPUT") == "1" and pq is not None
+PARQUET_FILE_NAME = "outlines.parquet"
+PARQUET_BATCH_SIZE = 64
+# Workers run a young-generation collection after every PDF and a full one this often
+FULL_GC_INTERVAL = 50
+# Inputs are rejected before dispatch when no "%PDF-" header appears in the
+# first HEADER_SCAN_BYTES (readers tolerate leading junk) or they exceed MAX_PDF_BYTES
+PDF_MAGIC = b"%PDF-"
+HEADER_SCAN_BYTES = 1024
+MAX_PDF_BYTES = 500_000_000
+# Progress is summarised once per this many files rather than logged per file
+SUMMARY_INTERVAL = 100
+
+_files_parsed = 0
+
+# mkstemp creates private files; outputs get the usual umask-derived mode instead
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def _init_worker():
+    """Pool initializer: collections run between PDFs instead of at arbitrary points mid-parse."""
+    gc.disable()
+
+def _process_one(source):
+    """Worker entry point: parses prefetched PDF bytes, or opens the path for oversized files."""
+    global _files_parsed
+    if isinstance(source, bytes):
+        result = extract_document_structure_from_bytes(source)
+    else:
+        result = extract_document_structure(source)
+
+    _files_parsed += 1
+    gc.collect(2 if _files_parsed % FULL_GC_INTERVAL == 0 else 1)
+    return result
+
+def _dump_json(data):
+    """Serializes data to indented UTF-8 JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    # ensure_ascii escapes non-ASCII text, so the result is plain ASCII bytes:
+    # valid UTF-8 that any JSON reader decodes to the same strings as orjson's output
+    return json.dumps(data, indent=2).encode("ascii")
+
+def _atomic_write(path, data):
+    """Writes data to a temporary sibling and renames it into place, so readers never see a partial file.
+
+    Each call gets its own temporary file, so concurrent writers of the same path cannot collide.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            os.fchmod(f.fileno(), 0o666 & ~_UMASK)
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _write_output(output_file, payload):
+    """Writes the JSON payload to the output file, zstd-compressing it when COMPRESS_OUTPUT is on."""
+    if COMPRESS_OUTPUT:
+        payload = zstandard.ZstdCompressor(level=3).compress(payload)
+    _atomic_write(output_file, payload)
+
+class _ParquetSink:
+    """Buffers one row per PDF and appends them to a single Parquet file in batches."""
+
+    def __init__(self, path):
+        self._path = path
+        self._tmp_path = path + ".tmp"
+        self._schema = pa.schema([("src", pa.string()), ("title", pa.string()),
+                                  ("outline_json", pa.string()), ("error", pa.string())])
+        self._writer = pq.ParquetWriter(self._tmp_path, self._schema)
+        self._rows = []
+
+    def add(self, name, title, outline, error=None):
+        if orjson is not None:
+            outline_json = orjson.dumps(outline).decode("utf-8")
+        else:
+            outline_json = json.dumps(outline)
+        self._rows.append({"src": name, "title": title, "outline_json": outline_json, "error": error})
+        if len(self._rows) >= PARQUET_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            self._writer.write_table(pa.Table.from_pylist(self._rows, schema=self._schema))
+            self._rows = []
+
+    def close(self):
+        """Writes the remaining rows and moves the finished file into place."""
+        self._flush()
+        self._writer.close()
+        os.replace(self._tmp_path, self._path)
+
+    def abort(self):
+        """Discards the partial store of an interrupted run."""
+        self._writer.close()
+        os.remove(self._tmp_path)
+
+class _WorkerPool:
+    """Process pool that is replaced when a worker dies, so one crashing PDF cannot stall the batch."""
+
+    def __init__(self, workers):
+        self._workers = workers
+        self._executor = self._new_executor()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self._workers, initializer=_init_worker)
+
+    async def run(self, source):
+        """Parses one PDF in a worker, retrying once on a fresh pool if the pool broke."""
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            return await loop.run_in_executor(executor, _process_one, source)
+        except BrokenProcessPool:
+            # Every in-flight parse sees the same broken pool; only the first
+            # handler to notice replaces it, and a PDF that crashes again fails
+            if self._executor is executor:
+                logger.warning("A worker process died; restarting the process pool.")
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+            return await loop.run_in_executor(self._executor, _process_one, source)
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+def _shard_of(stem):
+    """Returns the two-hex-digit subdirectory a PDF's output goes to when SHARD_OUTPUT is on."""
+    return hashlib.blake2b(stem.encode(), digest_size=1).hexdigest()
+
+def _extractor_version():
+    """Fingerprints the extractor source, so outlines cached by other heuristics are never reused."""
+    with open(extractor.__file__, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()[:12]
+
+def _load_cache_index(cache_dir):
+    """Loads the {file name: [mtime, size, md5]} index used to skip re-hashing unchanged PDFs."""
+    try:
+        with open(os.path.join(cache_dir, CACHE_INDEX_NAME), "rb") as f:
+            data = f.read()
+        return orjson.loads(data) if orjson is not None else json.loads(data)
+    except (OSError, ValueError):
+        return {}
+
+def _fingerprint(pdf_path, name, cache_index):
+    """Returns the MD5 of the PDF's content and, when the file had to be read, its bytes.
+
+    The indexed hash is reused when mtime and size are unchanged, in which case no bytes are returned.
+    Files too large to parse from memory are hashed through a memory map and no bytes are returned either.
+    """
+    stat = os.stat(pdf_path)
+    entry = cache_index.get(name)
+    if entry and entry[0] == stat.st_mtime and entry[1] == stat.st_size:
+        return entry[2], None
+
+    if stat.st_size >= IN_MEMORY_MAX_BYTES:
+        with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            data = None
+            digest = hashlib.md5(mm).hexdigest()
+    else:
+        with open(pdf_path, "rb") as f:
+            data = f.read()
+        digest = hashlib.md5(data).hexdigest()
+    cache_index[name] = [stat.st_mtime, stat.st_size, digest]
+    return digest, data
+
+def _validate_pdf(pdf_path):
+    """Returns why the file cannot be a PDF worth parsing, or None when it looks valid."""
+    size = os.path.getsize(pdf_path)
+    if size > MAX_PDF_BYTES:
+        return f"file is larger than {MAX_PDF_BYTES} bytes"
+    with open(pdf_path, "rb") as f:
+        header = f.read(HEADER_SCAN_BYTES)
+    if PDF_MAGIC not in header:
+        return "no PDF header found"
+    return None
+
+def _is_up_to_date(pdf_path, output_file, name, cache_index, cache_dir):
+    """
+    Returns True when the output JSON is no older than its source PDF and records
+    a successful extraction of the indexed content. Only successes are cached, so
+    failed outputs never count as up to date and are retried on the next run.
+    """
+    try:
+        stat = os.stat(pdf_path)
+        if os.stat(output_file).st_mtime < stat.st_mtime:
+            return False
+    except OSError:
+        return False
+    entry = cache_index.get(name)
+    return (entry is not None and entry[0] == stat.st_mtime and entry[1] == stat.st_size
+            and os.path.exists(f"{cache_dir}/{entry[2]}.json"))
+
+def _read_bytes(path):
+    """Reads a whole file as bytes."""
+    with open(path, "rb") as f:
+        return f.read()
+
+def _load_cached_outline(cached_file):
+    """
+    Returns (payload, decoded outline) for a cached outline, or None when it is
+    missing, unreadable or corrupt, in which case the PDF is simply parsed again.
+    """
+    try:
+        payload = _read_bytes(cached_file)
+        cached = orjson.loads(payload) if orjson is not None else json.loads(payload)
+        if isinstance(cached.get("title"), str) and isinstance(cached.get("outline"), list):
+            return payload, cached
+    except (OSError, ValueError, AttributeError):
+        pass
+    return None
+
+def _count_cached_headings(cached_file):
+    """Returns the number of headings in a cached outline, or 0 when it cannot be read."""
+    hit = _load_cached_outline(cached_file)
+    return len(hit[1]["outline"]) if hit is not None else 0
+
+def _read_pdf(pdf_path):
+    """Reads a PDF into memory unless it is too large to parse from a buffer."""
+    if os.path.getsize(pdf_path) >= IN_MEMORY_MAX_BYTES:
+        return None
+    return _read_bytes(pdf_path)
+
+async def _handle_pdf(pdf_path, output_dir, cache_dir, cache_index, pool, semaphore, prefetch,
+                      parquet_sink=None):
+    """Handles one PDF; any unexpected failure becomes that file's "error" outcome."""
+    try:
+        return await _process_pdf(pdf_path, output_dir, cache_dir, cache_index, pool, semaphore,
+                                  prefetch, parquet_sink)
+    except Exception as e:
+        logger.error("--> Failed to process %s: %r", os.path.basename(pdf_path), e)
+        return "error", 0
+
+async def _process_pdf(pdf_path, output_dir, cache_dir, cache_index, pool, semaphore, prefetch,
+                       parquet_sink):
+    """
+    Fingerprints, extracts and writes one PDF, keeping file I/O off the event loop.
+    Returns (outcome, headings count), outcome being "ok", "cached", "skipped", "rejected" or "error".
+    With a Parquet sink, the outline is added to it instead of being written as JSON.
+    """
+    name = os.path.basename(pdf_path)
+    suffix = ".json.zst" if COMPRESS_OUTPUT else ".json"
+    stem = name[:-4]
+    if SHARD_OUTPUT:
+        output_file = f"{output_dir}/{_shard_of(stem)}/{stem}{suffix}"
+    else:
+        output_file = f"{output_dir}/{stem}{suffix}"
+
+    # Reruns over unchanged inputs cost three stat calls per file, plus reading
+    # the small cached outline so the summary still counts its headings; a
+    # Parquet run rewrites the whole store, so every PDF must produce its row
+    if parquet_sink is None and await asyncio.to_thread(
+            _is_up_to_date, pdf_path, output_file, name, cache_index, cache_dir):
+        logger.debug("--> Skipped %s, output is up to date.", name)
+        cached_file = f"{cache_dir}/{cache_index[name][2]}.json"
+        return "skipped", await asyncio.to_thread(_count_cached_headings, cached_file)
+
+    try:
+        # Junk and pathological inputs are sidelined with one small read instead
+        # of failing deep inside the parser
+        reason = await asyncio.to_thread(_validate_pdf, pdf_path)
+        if reason is not None:
+            logger.warning("--> Rejected %s: %s", name, reason)
+            return "rejected", 0
+
+        # The prefetch semaphore bounds how many PDFs are held in memory at once:
+        # a few files are read ahead while the pool is busy parsing earlier ones
+        async with prefetch:
+            # Reuse the outline if this PDF's content was already extracted on a previous run
+            digest, data = await asyncio.to_thread(_fingerprint, pdf_path, name, cache_index)
+            cached_file = f"{cache_dir}/{digest}.json"
+            hit = None
+            if os.path.exists(cached_file):
+                hit = await asyncio.to_thread(_load_cached_outline, cached_file)
+            if hit is not None:
+                payload, cached = hit
+                if parquet_sink is not None:
+                    parquet_sink.add(name, cached["title"], cached["outline"])
+                else:
+                    await asyncio.to_thread(_write_output, output_file, payload)
+                logger.debug("--> Reused cached outline for %s.", name)
+                return "cached", len(cached["outline"])
+
+            if data is None:
+                data = await asyncio.to_thread(_read_pdf, pdf_path)
+            source = data if data is not None else pdf_path
+
+            # Parsing is CPU-bound and runs in the process pool; the semaphore only
+            # bounds in-flight parses, so writing this result overlaps the next parse
+            async with semaphore:
+                output_data = await pool.run(source)
+    except OSError as e:
+        # An unreadable input fails on its own, like a PDF the parser rejects
+        output_data = {"status": "error", "title": "", "outline": [],
+                       "error": f"Failed to open or read PDF: {e}"}
+    except BrokenProcessPool:
+        output_data = {"status": "error", "title": "", "outline": [],
+                       "error": "A worker process crashed while parsing the PDF"}
+
+    # Serialize once and write the encoded bytes in a single call per file;
+    # failures keep their reason in an "error" field so they cannot pass for
+    # a document without a title or headings
+    record = {"title": output_data["title"], "outline": output_data["outline"]}
+    if output_data["status"] == "error":
+        record["error"] = output_data["error"]
+    payload = _dump_json(record)
+    if parquet_sink is not None:
+        parquet_sink.add(name, record["title"], record["outline"], record.get("error"))
+    else:
+        await asyncio.to_thread(_write_output, output_file, payload)
+
+    if output_data["status"] == "error":
+        logger.error("--> Failed to process %s: %s", name, output_data["error"])
+        return "error", 0
+
+    await asyncio.to_thread(_atomic_write, cached_file, payload)
+    headings_count = len(output_data["outline"])
+    logger.debug("--> Successfully processed %s. Found %d headings.", name, headings_count)
+    return "ok", headings_count
+
+def _log_summary(done, total, outcomes, total_headings):
+    """Logs one line tallying the outcomes of the files handled so far."""
+    logger.info("[%d/%d] ok=%d cached=%d skipped=%d rejected=%d err=%d headings=%d",
+                done, total, outcomes["ok"], outcomes["cached"], outcomes["skipped"],
+                outcomes["rejected"], outcomes["error"], total_headings)
+
+async def process_pdfs():
+    logger.info("Starting processing PDFs")
+
+    # Requested output modes whose library is missing are reported, not silently dropped
+    if os.environ.get("COMPRESS_OUTPUT") == "1" and not COMPRESS_OUTPUT:
+        logger.warning("COMPRESS_OUTPUT=1 ignored: zstandard is not installed, writing plain JSON")
+    if os.environ.get("PARQUET_OUTPUT") == "1" and not PARQUET_OUTPUT:
+        logger.warning("PARQUET_OUTPUT=1 ignored: pyarrow is not installed, writing per-file JSON")
 
     # Define input and output directories
     input_dir = Path("/app/input")
     output_dir = Path("/app/output")
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    # Get all PDF files in the input directory
-    pdf_files = list(input_dir.glob("*.pdf"))
-    print(f"Found {len(pdf_files)} PDF(s) to process.")
-
-    for pdf_file in pdf_files:
-        print(f"Processing {pdf_file.name}...")
+    # Per-file paths are built as plain strings; Path stays at the boundary.
+    # Outlines are cached per extractor version, while the content hashes in
+    # the index stay valid across versions
+    output_dir = str(output_dir)
+    index_dir = os.path.join(output_dir, CACHE_DIR_NAME)
+    cache_dir = os.path.join(index_dir, _extractor_version())
+    os.makedirs(cache_dir, exist_ok=True)
 
-        # Extract document structure using actual logic
-        output_data = extract_document_structure(pdf_file)
+    # Get all PDF files in the input directory; scandir reports the entry type
+    # from the directory listing itself, and plain string paths are passed on
+    with os.scandir(input_dir) as entries:
+        pdf_files = [entry.path for entry in entries
+                     if entry.name.endswith(".pdf") and entry.is_file()]
+    logger.info("Found %d PDF(s) to process.", len(pdf_files))
 
-        # Write the structured output to a JSON file
-        output_file = output_dir / f"{pdf_file.stem}.json"
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump(output_data, f, indent=4, ensure_ascii=False)
+    # Each shard directory is created once up front, not checked per file
+    if SHARD_OUTPUT:
+        for shard in {_shard_of(os.path.basename(pdf_path)[:-4]) for pdf_path in pdf_files}:
+            os.makedirs(os.path.join(output_dir, shard), exist_ok=True)
 
-        if "Error:" in output_data.get("title", ""):
-            print(f"--> Finished {pdf_file.name} with an error.")
-        else:
-            headings_count = len(output_data.get("outline", []))
-            print(f"--> Successfully processed. Found {headings_count} headings.")
+    # PDFs are independent and CPU-bound, so they are parsed in parallel
+    # while reads, hashing and JSON writes run in threads alongside
+    cache_index = _load_cache_index(index_dir)
+    workers = os.cpu_count() or 1
+    semaphore = asyncio.Semaphore(workers)
+    prefetch = asyncio.Semaphore(workers + PREFETCH_DEPTH)
+    parquet_sink = _ParquetSink(os.path.join(output_dir, PARQUET_FILE_NAME)) if PARQUET_OUTPUT else None
+    outcomes = Counter()
+    total_headings = 0
+    pool = _WorkerPool(workers)
+    completed = False
+    try:
+        handlers = [
+            _handle_pdf(pdf_path, output_dir, cache_dir, cache_index, pool, semaphore, prefetch,
+                        parquet_sink)
+            for pdf_path in pdf_files
+        ]
+        for done, handler in enumerate(asyncio.as_completed(handlers), 1):
+            outcome, headings_count = await handler
+            outcomes[outcome] += 1
+            total_headings += headings_count
+            if done % SUMMARY_INTERVAL == 0:
+                _log_summary(done, len(pdf_files), outcomes, total_headings)
+        completed = True
+    finally:
+        # Hashes computed so far stay valid even if the run was interrupted,
+        # but a partial Parquet store is never moved into place
+        pool.shutdown()
+        if parquet_sink is not None:
+            if completed:
+                parquet_sink.close()
+            else:
+                parquet_sink.abort()
+        _atomic_write(os.path.join(index_dir, CACHE_INDEX_NAME), _dump_json(cache_index))
 
-    print("Completed processing PDFs")
+    if not pdf_files or len(pdf_files) % SUMMARY_INTERVAL:
+        _log_summary(len(pdf_files), len(pdf_files), outcomes, total_headings)
+    logger.info("Completed processing PDFs")
 
 if __name__ == "__main__":
-    process_pdfs()
+    # Progress is only reported from the main process, so one stdout handler suffices
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s", stream=sys.stdout)
+    asyncio.run(process_pdfs())
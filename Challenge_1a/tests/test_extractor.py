@@ -0,0 +1,64 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz
+
+from extractor import _clean_repetitive_title, _collect_spans, _profile_document_styles
+
+
+def _reference_clean_repetitive_title(title):
+    """The original word-by-word dedup loop the optimized version must match."""
+    words = title.split()
+    cleaned_words = []
+
+    for i, word in enumerate(words):
+        if i > 0 and word.lower() == words[i-1].lower():
+            continue
+        if (i > 1 and
+            word.lower() == words[i-2].lower() and
+            len(cleaned_words) > 1 and
+            cleaned_words[-1].lower() == words[i-1].lower()):
+            continue
+        cleaned_words.append(word)
+
+    return ' '.join(cleaned_words)
+
+
+def test_clean_repetitive_title_known_inputs():
+    cases = {
+        "A B A": "A B",
+        "foo bar foo baz": "foo bar baz",
+        "Chapter 3 Chapter Plan Analysis": "Chapter 3 Plan Analysis",
+        "Overview Overview of the the Plan": "Overview of the Plan",
+        "RFP: RFP: Request for Proposal": "RFP: Request for Proposal",
+        "a A b B a": "a b a",
+        "": "",
+    }
+    for title, expected in cases.items():
+        assert _reference_clean_repetitive_title(title) == expected
+        assert _clean_repetitive_title(title) == expected
+
+
+def test_clean_repetitive_title_matches_reference():
+    rng = random.Random(0)
+    vocabulary = ["A", "a", "B", "b", "C", "Plan", "plan", "3", "of"]
+    for _ in range(5000):
+        title = " ".join(rng.choice(vocabulary) for _ in range(rng.randint(0, 8)))
+        assert _clean_repetitive_title(title) == _reference_clean_repetitive_title(title)
+
+
+def test_body_size_ties_follow_content_stream_order():
+    # Equal span counts: the size drawn first wins, even though it sits lower on the page
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 600), "A long body paragraph written at twelve points with enough characters to count.", fontsize=12)
+    page.insert_text((72, 200), "Another long paragraph written at ten points with plenty of characters to count.", fontsize=10)
+    doc = fitz.open(stream=doc.tobytes(), filetype="pdf")
+
+    pages, font_size_stats, all_fonts = _collect_spans(doc)
+    assert _profile_document_styles(font_size_stats, all_fonts)["body_size"] == 12.0
+    # The heading pass still sees blocks in reading order
+    assert [round(bbox[1]) < 400 for bbox, _ in pages[0][3]] == [True, False]